@@ -0,0 +1,429 @@
+# ---------------------------------------------------------
+# Bahmni AI + DHIS2 Sync Tool
+# Copyright (c) 2026 [Deepak Neupane]
+# Licensed under the MIT License (see LICENSE for details)
+# ---------------------------------------------------------
+# ================================
+# File: aggregates.py
+# Purpose: Pre-aggregated summary tables for recurring reports
+# ================================
+#
+# Each registered summary keeps a row-level ledger (row id -> day, dimension,
+# midnight and active flags) and a per-day count table in a local SQLite store. Refreshes
+# are incremental: only OpenMRS rows created/changed/voided since the stored
+# high-water mark are fetched, their ledger entries replaced, and the touched
+# days recounted. Monthly figures are rolled up from the daily rows.
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from db import execute_sql
+from llm import get_template
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+AGG_DB_PATH = os.path.join(BASE_DIR, "data", "aggregate_store.db")
+
+# A summary older than this still answers, and is refreshed in the background.
+MAX_AGE_SECONDS = int(os.getenv("AGGREGATE_MAX_AGE_SECONDS", "300"))
+# Past this age (or after a failed refresh) a summary stops answering and the
+# question goes to the live path until a refresh succeeds.
+HARD_MAX_AGE_SECONDS = int(os.getenv("AGGREGATE_HARD_MAX_AGE_SECONDS", "3600"))
+# Re-read a small window before the high-water mark to catch late commits.
+LOOKBACK_SECONDS = int(os.getenv("AGGREGATE_LOOKBACK_SECONDS", "60"))
+# High-water recorded after a successful build of an empty source
+EMPTY_HIGH_WATER = "1970-01-01 00:00:00"
+
+# --------------------------------
+# Registered summary definitions
+# --------------------------------
+# "source" must select row_id, day, dim, midnight, voided and changed_at;
+# "{since}" is replaced by one "<change column> >= high-water" filter per UNION
+# branch. "midnight" marks rows stamped exactly 00:00:00, the only ones a raw
+# "col BETWEEN 'start' AND 'end'" filter keeps on its end day.
+SUMMARIES = {
+    "person_registrations": {
+        "description": "New person registrations per day",
+        "change_columns": ["p.date_created", "p.date_changed", "p.date_voided"],
+        "source": """
+            SELECT p.person_id AS row_id, DATE(p.date_created) AS day, '' AS dim,
+                   0 AS midnight, p.voided AS voided, {changed_at} AS changed_at
+            FROM person p
+            WHERE 1 = 1 {since}
+        """,
+    },
+    "program_enrollment": {
+        "description": "Program enrollments per day, by program name (Report 103)",
+        "change_columns": ["pp.date_created", "pp.date_changed", "pp.date_voided"],
+        "source": """
+            SELECT pp.patient_program_id AS row_id, DATE(pp.date_enrolled) AS day,
+                   prog.name AS dim, TIME(pp.date_enrolled) = '00:00:00' AS midnight,
+                   pp.voided AS voided, {changed_at} AS changed_at
+            FROM patient_program pp
+            JOIN program prog ON pp.program_id = prog.program_id
+            WHERE 1 = 1 {since}
+        """,
+    },
+    "anc_obs": {
+        # An obs whose concept has several matching names counts once, under
+        # the first name alphabetically (the SQL returned by answer() agrees)
+        "description": "ANC/Pregnancy observations per day, by question name",
+        "change_columns": ["o.date_created", "o.date_voided"],
+        "source": """
+            SELECT o.obs_id AS row_id, DATE(o.obs_datetime) AS day, MIN(cn.name) AS dim,
+                   0 AS midnight, o.voided AS voided, {changed_at} AS changed_at
+            FROM obs o
+            JOIN concept_name cn ON o.concept_id = cn.concept_id
+            WHERE (cn.name LIKE '%ANC%' OR cn.name LIKE '%Pregnancy%') {since}
+            GROUP BY o.obs_id, o.obs_datetime, o.voided, o.date_created, o.date_voided
+        """,
+    },
+}
+
+_locks = {name: threading.Lock() for name in SUMMARIES}
+
+# --------------------------------
+# Local store
+# --------------------------------
+def _connect():
+    os.makedirs(os.path.dirname(AGG_DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(AGG_DB_PATH)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS aggregate_ledger (
+            summary TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            day TEXT,
+            dim TEXT NOT NULL DEFAULT '',
+            midnight INTEGER NOT NULL DEFAULT 0,
+            active INTEGER NOT NULL,
+            PRIMARY KEY (summary, row_id)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS aggregate_daily (
+            summary TEXT NOT NULL,
+            day TEXT NOT NULL,
+            dim TEXT NOT NULL DEFAULT '',
+            total INTEGER NOT NULL,
+            midnight_total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (summary, day, dim)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS aggregate_state (
+            summary TEXT PRIMARY KEY,
+            high_water TEXT,
+            last_refresh TEXT,
+            last_rebuild TEXT,
+            rows_scanned INTEGER DEFAULT 0,
+            status TEXT,
+            error TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_day ON aggregate_ledger (summary, day)")
+    columns = {c[1] for c in conn.execute("PRAGMA table_info(aggregate_ledger)")}
+    if "midnight" not in columns:
+        # Stores built before the midnight flag: add it and rebuild everything
+        conn.execute("ALTER TABLE aggregate_ledger ADD COLUMN midnight INTEGER NOT NULL DEFAULT 0")
+        conn.execute("ALTER TABLE aggregate_daily ADD COLUMN midnight_total INTEGER NOT NULL DEFAULT 0")
+        conn.execute("UPDATE aggregate_state SET high_water = NULL")
+        conn.commit()
+    return conn
+
+def _get_state(conn, name):
+    row = conn.execute(
+        "SELECT high_water, last_refresh, last_rebuild, rows_scanned, status, error "
+        "FROM aggregate_state WHERE summary = ?", (name,)
+    ).fetchone()
+    if not row:
+        return None
+    keys = ["high_water", "last_refresh", "last_rebuild", "rows_scanned", "status", "error"]
+    return dict(zip(keys, row))
+
+def _save_state(conn, name, **fields):
+    conn.execute("INSERT OR IGNORE INTO aggregate_state (summary) VALUES (?)", (name,))
+    for key, value in fields.items():
+        conn.execute(f"UPDATE aggregate_state SET {key} = ? WHERE summary = ?", (value, name))
+
+def _chunks(items, size=500):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+# --------------------------------
+# Refresh
+# --------------------------------
+def _fetch_changes(definition, high_water):
+    cols = definition["change_columns"]
+    changed_at = "GREATEST(" + ", ".join(f"COALESCE({c}, {cols[0]})" for c in cols) + ")"
+    if not high_water:
+        return execute_sql(definition["source"].format(changed_at=changed_at, since=""))
+    # One range scan per change column (each can use its index); an OR across
+    # the columns would force a full table scan. UNION drops the duplicates.
+    sql = "\nUNION\n".join(
+        definition["source"].format(changed_at=changed_at, since=f"AND {c} >= %s") for c in cols
+    )
+    return execute_sql(sql, tuple([high_water] * len(cols)))
+
+def refresh(name, full=False):
+    """
+    Brings one summary up to date. Incremental unless `full` is set or the
+    summary has never been built. Returns its freshness info.
+    """
+    if name not in SUMMARIES:
+        raise Exception(f"Unknown summary: {name}")
+
+    with _locks[name]:
+        conn = _connect()
+        try:
+            state = _get_state(conn, name) or {}
+            full = full or not state.get("high_water")
+            since = None
+            if not full:
+                hw = datetime.strptime(state["high_water"], "%Y-%m-%d %H:%M:%S")
+                since = (hw - timedelta(seconds=LOOKBACK_SECONDS)).strftime("%Y-%m-%d %H:%M:%S")
+
+            try:
+                rows = _fetch_changes(SUMMARIES[name], since)
+            except Exception as e:
+                _save_state(conn, name, status="error", error=str(e))
+                conn.commit()
+                raise
+
+            if full:
+                conn.execute("DELETE FROM aggregate_ledger WHERE summary = ?", (name,))
+                conn.execute("DELETE FROM aggregate_daily WHERE summary = ?", (name,))
+
+            touched = set()
+            entries = {}
+            for r in rows:
+                day = str(r["day"]) if r["day"] is not None else None
+                active = 1 if day and not r["voided"] else 0
+                entries[r["row_id"]] = (name, r["row_id"], day, r["dim"] or "", 1 if r["midnight"] else 0, active)
+                if day:
+                    touched.add(day)
+
+            if not full:
+                # Rows whose day moved must also recount the day they left.
+                for ids in _chunks(entries):
+                    marks = ",".join("?" * len(ids))
+                    old = conn.execute(
+                        f"SELECT day FROM aggregate_ledger WHERE summary = ? AND row_id IN ({marks})",
+                        [name] + ids,
+                    ).fetchall()
+                    touched.update(d for (d,) in old if d)
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO aggregate_ledger (summary, row_id, day, dim, midnight, active) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                list(entries.values()),
+            )
+
+            for days in _chunks(sorted(touched)):
+                marks = ",".join("?" * len(days))
+                conn.execute(f"DELETE FROM aggregate_daily WHERE summary = ? AND day IN ({marks})", [name] + days)
+                conn.execute(f"""
+                    INSERT INTO aggregate_daily (summary, day, dim, total, midnight_total)
+                    SELECT summary, day, dim, COUNT(*), SUM(midnight) FROM aggregate_ledger
+                    WHERE summary = ? AND active = 1 AND day IN ({marks})
+                    GROUP BY summary, day, dim
+                """, [name] + days)
+
+            high_water = state.get("high_water") if not full else None
+            for r in rows:
+                if r["changed_at"] is None:
+                    continue
+                stamp = r["changed_at"].strftime("%Y-%m-%d %H:%M:%S")
+                if not high_water or stamp > high_water:
+                    high_water = stamp
+            if not high_water:
+                # Built, but the source is empty: don't look "never built" forever
+                high_water = EMPTY_HIGH_WATER
+
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            fields = {"high_water": high_water, "last_refresh": now, "rows_scanned": len(rows),
+                      "status": "ready", "error": None}
+            if full:
+                fields["last_rebuild"] = now
+            _save_state(conn, name, **fields)
+            conn.commit()
+        finally:
+            conn.close()
+
+    return summary_info(name)
+
+def rebuild(name):
+    """Drops and rebuilds a summary from the full OpenMRS history."""
+    return refresh(name, full=True)
+
+def refresh_all():
+    for name in SUMMARIES:
+        try:
+            refresh(name)
+        except Exception as e:
+            print(f"Aggregate refresh error ({name}): {e}")
+
+# --------------------------------
+# Freshness / listing
+# --------------------------------
+def summary_info(name):
+    conn = _connect()
+    try:
+        state = _get_state(conn, name) or {}
+        daily_rows = conn.execute(
+            "SELECT COUNT(*) FROM aggregate_daily WHERE summary = ?", (name,)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+    age = None
+    if state.get("last_refresh"):
+        refreshed = datetime.strptime(state["last_refresh"], "%Y-%m-%d %H:%M:%S")
+        age = int((datetime.now() - refreshed).total_seconds())
+
+    return {
+        "name": name,
+        "description": SUMMARIES[name]["description"],
+        "status": state.get("status") or "not_built",
+        "high_water": state.get("high_water"),
+        "last_refresh": state.get("last_refresh"),
+        "last_rebuild": state.get("last_rebuild"),
+        "age_seconds": age,
+        "stale": age is None or age > MAX_AGE_SECONDS,
+        "rows_scanned": state.get("rows_scanned") or 0,
+        "daily_rows": daily_rows,
+        "error": state.get("error"),
+    }
+
+def list_summaries():
+    return [summary_info(name) for name in SUMMARIES]
+
+# --------------------------------
+# Answering report questions
+# --------------------------------
+# Exact (normalized) questions each summary answers. Anything else, however
+# close, goes to the LLM so the answer always matches what was asked.
+REGISTERED_QUESTIONS = {
+    "monthly growth": ("person_registrations", "monthly_growth"),
+    "monthly registration growth": ("person_registrations", "monthly_growth"),
+    "registered patients": ("person_registrations", "range_total"),
+    "total patients registered": ("person_registrations", "range_total"),
+    "anc observation count": ("anc_obs", "by_question"),
+    "anc observation counts": ("anc_obs", "by_question"),
+}
+
+def _date(value):
+    # Only plain dates: a time part would change what the live SQL counts
+    if not value or not re.fullmatch(r"\d{4}-\d{2}-\d{2}", str(value).strip()):
+        return None
+    return str(value).strip()
+
+def normalize_question(question):
+    return re.sub(r"\s+", " ", question.lower()).strip().rstrip("?.! ")
+
+def _match(question):
+    """Returns (summary, query_kind) only for the 103 report ID or a registered question."""
+    question = normalize_question(question)
+    if re.fullmatch(r"(?:sql\s+)?103", question):
+        return "program_enrollment", "by_program_month"
+    return REGISTERED_QUESTIONS.get(question)
+
+def _ensure_fresh(name):
+    """
+    Returns the summary's freshness info when it may answer, else None.
+    A stale summary still answers (up to HARD_MAX_AGE_SECONDS) and is
+    refreshed in the background; one that was never built starts its build.
+    """
+    info = summary_info(name)
+    if not info["high_water"] or info["stale"]:
+        _refresh_in_background(name)
+    if not info["high_water"] or info["status"] == "error":
+        return None
+    if info["age_seconds"] is None or info["age_seconds"] > HARD_MAX_AGE_SECONDS:
+        return None
+    return info
+
+def _refresh_in_background(name):
+    if _locks[name].locked():
+        return
+
+    def run():
+        try:
+            refresh(name)
+        except Exception as e:
+            print(f"Aggregate refresh error ({name}): {e}")
+
+    threading.Thread(target=run, daemon=True).start()
+
+def answer(question, start_date=None, end_date=None):
+    """
+    Answers a report question from a summary table.
+    Returns {"sql", "data", "summary", "high_water", "age_seconds"} or None
+    to fall back to the live path.
+    """
+    clean_q = question.lower().strip()
+    hit = _match(clean_q)
+    if not hit:
+        return None
+    name, kind = hit
+    start, end = _date(start_date), _date(end_date)
+    if kind != "monthly_growth" and not (start and end):
+        return None
+    template = get_template("103") if kind == "by_program_month" else None
+    if kind == "by_program_month" and not template:
+        return None
+    info = _ensure_fresh(name)
+    if not info:
+        return None
+
+    started = time.perf_counter()
+    conn = _connect()
+    try:
+        if kind == "by_program_month":
+            # queries/103.sql compares the raw datetime, so on the end day only
+            # enrollments stamped at midnight are inside the range
+            rows = conn.execute("""
+                SELECT dim, substr(day, 1, 7) AS month,
+                       SUM(CASE WHEN day = ? THEN midnight_total ELSE total END) AS n
+                FROM aggregate_daily
+                WHERE summary = ? AND day BETWEEN ? AND ?
+                GROUP BY dim, month HAVING n > 0 ORDER BY dim, month
+            """, (end, name, start, end)).fetchall()
+            data = [{"Program Name": d, "Enrollment Count": c, "Month": m} for d, m, c in rows]
+            sql = template.replace("{start_date}", start).replace("{end_date}", end)
+        elif kind == "monthly_growth":
+            rows = conn.execute("""
+                SELECT substr(day, 1, 7) AS month, SUM(total) FROM aggregate_daily
+                WHERE summary = ? GROUP BY month ORDER BY month DESC LIMIT 12
+            """, (name,)).fetchall()
+            data = [{"Month": m, "New_Registrations": c} for m, c in rows]
+            sql = ("SELECT DATE_FORMAT(date_created, '%Y-%m') as Month, COUNT(*) as New_Registrations "
+                   "FROM person WHERE voided = 0 GROUP BY Month ORDER BY Month DESC LIMIT 12")
+        elif kind == "range_total":
+            total = conn.execute("""
+                SELECT COALESCE(SUM(total), 0) FROM aggregate_daily
+                WHERE summary = ? AND day BETWEEN ? AND ?
+            """, (name, start, end)).fetchone()[0]
+            data = [{"Registrations": total}]
+            sql = (f"SELECT COUNT(*) as Registrations FROM person WHERE voided = 0 "
+                   f"AND DATE(date_created) BETWEEN '{start}' AND '{end}'")
+        else:
+            rows = conn.execute("""
+                SELECT dim, SUM(total) FROM aggregate_daily
+                WHERE summary = ? AND day BETWEEN ? AND ?
+                GROUP BY dim ORDER BY dim
+            """, (name, start, end)).fetchall()
+            data = [{"Question": d, "Observations": c} for d, c in rows]
+            sql = (f"SELECT Question, COUNT(*) as Observations FROM (SELECT o.obs_id, MIN(cn.name) as Question "
+                   f"FROM obs o JOIN concept_name cn ON o.concept_id = cn.concept_id WHERE o.voided = 0 "
+                   f"AND (cn.name LIKE '%ANC%' OR cn.name LIKE '%Pregnancy%') "
+                   f"AND DATE(o.obs_datetime) BETWEEN '{start}' AND '{end}' GROUP BY o.obs_id) x "
+                   f"GROUP BY Question")
+    finally:
+        conn.close()
+
+    print(f"Answered from summary '{name}' in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return {"sql": sql, "data": data, "summary": name,
+            "high_water": info["high_water"], "age_seconds": info["age_seconds"]}
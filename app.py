@@ -6,32 +6,62 @@ import os
 import re
 import json
 import sqlite3
+import time
+import threading
 import requests
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import List
 from difflib import get_close_matches
 
-from llm import ask_llm
-from prompt import build_prompt
-from validator import validate_sql
-from db import execute_sql 
+from llm import ask_llm, load_templates, ping_llm
+from prompt import build_prompt, build_system_prompt, load_schema
+from validator import validate_sql, check_sql, format_reasons, SQLValidationError, get_allowlist
+from db import execute_sql, warm_pool
+from aggregates import answer as answer_from_summary, list_summaries, refresh as refresh_summary, rebuild as rebuild_summary, refresh_all as refresh_all_summaries, SUMMARIES, AGG_DB_PATH
 from dhis2_mapping.dhis2_mapper import DHIS2Mapper
 
 app = FastAPI()
-mapper = DHIS2Mapper()
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 LOG_FILE = os.path.join(BASE_DIR, "sync_logs.json")
 DB_PATH = os.path.join(BASE_DIR, "data", "memory_store.db")
+CATALOG_PATH = os.path.join(BASE_DIR, "list", "ai_lists.txt")
 
 app.mount("/htmls", StaticFiles(directory="htmls"), name="htmls")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
 DHIS2_BASE_URL = "https://play.im.dhis2.org/stable-2-42-4/api/dataValueSets"
+REPORT_PACK_MAX_QUESTIONS = int(os.getenv("REPORT_PACK_MAX_QUESTIONS", "30"))
+REPORT_PACK_WORKERS = int(os.getenv("REPORT_PACK_WORKERS", "8"))
+SQL_RETRY_ATTEMPTS = int(os.getenv("SQL_RETRY_ATTEMPTS", "1"))
+
+# Heavy objects are created on first use or by the startup phase, not at import
+_mapper = None
+_catalog = {"mtime": None, "reports": []}
+
+def get_mapper():
+    global _mapper
+    if _mapper is None:
+        _mapper = DHIS2Mapper()
+    return _mapper
+
+def load_report_catalog():
+    """Report names from ai_lists.txt, re-read only when the file changes."""
+    try:
+        mtime = os.path.getmtime(CATALOG_PATH)
+    except OSError:
+        return []
+    if mtime != _catalog["mtime"]:
+        with open(CATALOG_PATH, "r") as f:
+            _catalog["reports"] = [line.strip() for line in f.readlines() if line.strip()]
+        _catalog["mtime"] = mtime
+    return _catalog["reports"]
 
 # --- Models ---
 class QueryPayload(BaseModel):
@@ -46,6 +76,17 @@ class SyncPayload(BaseModel):
     report_name: str
     period: str
 
+class ReportPackPayload(BaseModel):
+    questions: List[str]
+    start_date: str
+    end_date: str
+
+class SyncPackPayload(BaseModel):
+    dhis_user: str
+    dhis_pass: str
+    reports: list
+    period: str
+
 class FeedbackPayload(BaseModel):
     question: str
     sql: str
@@ -72,31 +113,8 @@ def get_logs():
                 return []
     return []
 
-@app.post("/ai/query")
-def ai_query(payload: QueryPayload):
-    user_q = payload.question.lower().strip()
-    try:
-        with open("schema.yaml") as f: schema = f.read()
-    except: schema = ""
-
-    full_prompt = build_prompt(schema, user_q, payload.start_date, payload.end_date)
-    
-    try:
-        sql_raw = ask_llm(full_prompt, question_text=user_q, start_date=payload.start_date, end_date=payload.end_date)
-        sql = re.sub(r'```sql|```', '', sql_raw).strip()
-    except Exception as e:
-        # Fallback if AI connection fails (per your logs)
-        print(f"AI Connection Error: {e}")
-        sql = "SELECT 'Fallback' as Status, COUNT(*) as Active_Patients FROM patient WHERE voided = 0"
-    
-    if "SECURITY" in sql: return {"sql": sql, "data": [], "report_name": "SecurityAlert"}
-
-    try:
-        validate_sql(sql)
-        data = execute_sql(sql)
-    except Exception as e:
-        return {"sql": sql, "data": [{"Error": str(e)}], "report_name": "Error"}
-    
+def resolve_report_name(user_q):
+    """Maps a question to a DHIS2 report name (manual IDs, then ai_lists.txt matches)."""
     # --- IMPROVED DYNAMIC REPORT NAMING ---
     report_name = "AI_Generated_Report" 
     matched = False
@@ -107,14 +125,11 @@ def ai_query(payload: QueryPayload):
         report_name = f"Report_{id_match.group(0)}"
         matched = True
     
-    # 2. Key-word and Fuzzy Match from ai_list.txt
+    # 2. Key-word and Fuzzy Match from ai_lists.txt
     if not matched:
         try:
-            list_path = os.path.join(BASE_DIR, "list", "ai_list.txt")
-            if os.path.exists(list_path):
-                with open(list_path, "r") as f:
-                    available_reports = [line.strip() for line in f.readlines() if line.strip()]
-                
+            available_reports = load_report_catalog()
+            if available_reports:
                 for name in available_reports:
                     if name.lower() in user_q:
                         report_name = name
@@ -132,50 +147,162 @@ def ai_query(payload: QueryPayload):
         except Exception as e:
             print(f"Fuzzy match error: {e}")
 
-    # Log Sync logic
-    last_sync_info = None
-    logs = get_logs()
-    for log in logs:
-        if log.get("report") == report_name:
-            last_sync_info = log
+    return report_name
+
+def find_last_sync(report_name, logs=None):
+    for log in (get_logs() if logs is None else logs):
+        # Pack syncs log one "ReportPack" entry listing every report they pushed
+        if log.get("report") == report_name or report_name in (log.get("reports") or []):
+            return log
+    return None
+
+def answer_question(user_q, start_date, end_date, system_prompt=None):
+    """
+    Summary lookup -> SQL generation -> validation -> execution for one question.
+    With `system_prompt` the shared (question-free) prompt prefix is sent as-is.
+    """
+    # Recurring reports are answered from pre-aggregated summaries when possible
+    try:
+        summary_hit = answer_from_summary(user_q, start_date, end_date)
+    except Exception as e:
+        print(f"Summary lookup error: {e}")
+        summary_hit = None
+
+    if summary_hit:
+        return {"sql": summary_hit["sql"], "data": summary_hit["data"], "report_name": resolve_report_name(user_q),
+                "summary": {k: summary_hit[k] for k in ("summary", "high_water", "age_seconds")}}
+
+    if system_prompt is None:
+        system_prompt = build_prompt(load_schema(), user_q, start_date, end_date)
+
+    try:
+        sql_raw = ask_llm(system_prompt, question_text=user_q, start_date=start_date, end_date=end_date)
+        sql = re.sub(r'```sql|```', '', sql_raw).strip()
+    except Exception as e:
+        # Fallback if AI connection fails (per your logs)
+        print(f"AI Connection Error: {e}")
+        sql = "SELECT 'Fallback' as Status, COUNT(*) as Active_Patients FROM patient WHERE voided = 0"
+    
+    if "SECURITY" in sql: return {"sql": sql, "data": [], "report_name": "SecurityAlert"}
+
+    # Feed structured validator reasons back to the LLM; appended after the shared prefix
+    for _ in range(SQL_RETRY_ATTEMPTS):
+        reasons = check_sql(sql)
+        if not reasons:
             break
+        retry_prompt = system_prompt + f"""
+## PREVIOUS SQL WAS REJECTED BY THE VALIDATOR:
+{sql}
+{format_reasons(reasons)}
+Fix every issue above and return ONLY the corrected SQL.
+"""
+        try:
+            retry_sql = re.sub(r'```sql|```', '', ask_llm(retry_prompt, question_text=user_q, start_date=start_date, end_date=end_date)).strip()
+        except Exception as e:
+            print(f"AI Retry Error: {e}")
+            break
+        if not retry_sql or retry_sql == sql or "SECURITY" in retry_sql:
+            break
+        sql = retry_sql
 
-    return {"sql": sql, "data": data, "report_name": report_name, "last_sync": last_sync_info}
+    try:
+        validate_sql(sql)
+        data = execute_sql(sql)
+    except SQLValidationError as e:
+        return {"sql": sql, "data": [{"Error": str(e)}], "report_name": "Error", "validation": e.reasons}
+    except Exception as e:
+        return {"sql": sql, "data": [{"Error": str(e)}], "report_name": "Error"}
+
+    return {"sql": sql, "data": data, "report_name": resolve_report_name(user_q)}
+
+@app.post("/ai/query")
+def ai_query(payload: QueryPayload):
+    user_q = payload.question.lower().strip()
+    result = answer_question(user_q, payload.start_date, payload.end_date)
+    if result["report_name"] in ("SecurityAlert", "Error"):
+        return result
+
+    # Log Sync logic
+    result["last_sync"] = find_last_sync(result["report_name"])
+    return result
+
+@app.post("/ai/report-pack")
+def ai_report_pack(payload: ReportPackPayload):
+    """
+    Answers many questions for one date range. The system prompt is built once
+    and shared, so every LLM call starts with the same cacheable prefix;
+    questions run concurrently (LLM calls are capped by LLM_MAX_CONCURRENCY).
+    """
+    questions = [q.lower().strip() for q in payload.questions if q and q.strip()]
+    if not questions:
+        return {"status": "error", "message": "No questions supplied."}
+    if len(questions) > REPORT_PACK_MAX_QUESTIONS:
+        return {"status": "error", "message": f"A report pack is limited to {REPORT_PACK_MAX_QUESTIONS} questions."}
+
+    started = time.perf_counter()
+    system_prompt = build_system_prompt(load_schema(), payload.start_date, payload.end_date)
+
+    with ThreadPoolExecutor(max_workers=min(REPORT_PACK_WORKERS, len(questions))) as pool:
+        results = list(pool.map(
+            lambda q: answer_question(q, payload.start_date, payload.end_date, system_prompt=system_prompt),
+            questions
+        ))
+
+    logs = get_logs()
+    reports = []
+    for question, result in zip(questions, results):
+        result["question"] = question
+        result["last_sync"] = find_last_sync(result["report_name"], logs)
+        reports.append(result)
+
+    return {
+        "status": "completed",
+        "start_date": payload.start_date,
+        "end_date": payload.end_date,
+        "reports": reports,
+        "elapsed_ms": int((time.perf_counter() - started) * 1000)
+    }
 
 # --- Sync Logic ---
 
+def push_to_dhis2(dhis_payload, dhis_user, dhis_pass):
+    """Posts a dataValueSets payload and returns the imported + updated count."""
+    response = requests.post(
+        f"{DHIS2_BASE_URL}?importStrategy=CREATE_AND_UPDATE&dryRun=false", 
+        auth=(dhis_user, dhis_pass), 
+        json=dhis_payload, 
+        timeout=20
+    )
+    
+    res_json = response.json()
+    counts = res_json.get("response", {}).get("importCount", {})
+    return counts.get("imported", 0) + counts.get("updated", 0)
+
+def append_sync_logs(entries):
+    logs = get_logs()
+    logs[:0] = entries
+    with open(LOG_FILE, "w") as f:
+        json.dump(logs[:200], f, indent=4)
+
 @app.post("/ai/sync/dhis2")
 def sync_to_dhis2(payload: SyncPayload):
     try:
         clean_period = re.sub(r'[^0-9]', '', payload.period)
-        dhis_payload = mapper.transform(payload.data, period=clean_period, report_name=payload.report_name)
+        dhis_payload = get_mapper().transform(payload.data, period=clean_period, report_name=payload.report_name)
         
         if not dhis_payload or not dhis_payload.get("dataValues"):
             return {"status": "error", "message": "Mapping failed: No matching data elements found."}
 
-        response = requests.post(
-            f"{DHIS2_BASE_URL}?importStrategy=CREATE_AND_UPDATE&dryRun=false", 
-            auth=(payload.dhis_user, payload.dhis_pass), 
-            json=dhis_payload, 
-            timeout=20
-        )
-        
-        res_json = response.json()
-        counts = res_json.get("response", {}).get("importCount", {})
-        success = counts.get("imported", 0) + counts.get("updated", 0)
+        success = push_to_dhis2(dhis_payload, payload.dhis_user, payload.dhis_pass)
 
         if success > 0:
-            new_log = {
+            append_sync_logs([{
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "period": payload.period,
                 "report": payload.report_name,
                 "count": success,
                 "status": "Success"
-            }
-            logs = get_logs()
-            logs.insert(0, new_log)
-            with open(LOG_FILE, "w") as f:
-                json.dump(logs[:200], f, indent=4)
+            }])
 
             return {"status": "completed", "message": f"Successfully synced {success} records."}
         else:
@@ -183,6 +310,163 @@ def sync_to_dhis2(payload: SyncPayload):
     except Exception as e:
         return {"status": "error", "message": f"Sync Error: {str(e)}"}
 
+@app.post("/ai/sync/dhis2/pack")
+def sync_pack_to_dhis2(payload: SyncPackPayload):
+    """Maps every report of a report pack and pushes them in a single DHIS2 request."""
+    try:
+        clean_period = re.sub(r'[^0-9]', '', payload.period)
+        data_values, mapped = [], {}
+        for report in payload.reports:
+            name = report.get("report_name")
+            if not name or name in ("SecurityAlert", "Error"):
+                continue
+            dhis_payload = get_mapper().transform(report.get("data") or [], period=clean_period, report_name=name)
+            if dhis_payload and dhis_payload.get("dataValues"):
+                data_values.extend(dhis_payload["dataValues"])
+                mapped[name] = mapped.get(name, 0) + len(dhis_payload["dataValues"])
+
+        if not data_values:
+            return {"status": "error", "message": "Mapping failed: No matching data elements found."}
+
+        success = push_to_dhis2({"dataValues": data_values}, payload.dhis_user, payload.dhis_pass)
+
+        if success > 0:
+            # DHIS2 returns one import count for the whole request, so the pack gets one log entry
+            append_sync_logs([{
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "period": payload.period,
+                "report": "ReportPack",
+                "reports": list(mapped),
+                "count": success,
+                "status": "Success"
+            }])
+            return {"status": "completed", "message": f"Successfully synced {success} records from {len(mapped)} reports.", "reports": list(mapped)}
+        else:
+            return {"status": "warning", "message": "DHIS2 accepted but 0 records updated."}
+    except Exception as e:
+        return {"status": "error", "message": f"Sync Error: {str(e)}"}
+
+# --- Pre-aggregated Summary Routes ---
+
+@app.get("/ai/aggregates")
+def get_summaries():
+    return list_summaries()
+
+@app.post("/ai/aggregates/{name}/refresh")
+def refresh_summary_route(name: str):
+    if name not in SUMMARIES:
+        return {"status": "error", "message": f"Unknown summary: {name}"}
+    try:
+        return {"status": "success", "summary": refresh_summary(name)}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@app.post("/ai/aggregates/{name}/rebuild")
+def rebuild_summary_route(name: str):
+    if name not in SUMMARIES:
+        return {"status": "error", "message": f"Unknown summary: {name}"}
+    try:
+        return {"status": "success", "summary": rebuild_summary(name)}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+# --- Startup & Readiness ---
+
+STARTUP_STATE = {"status": "starting", "started_at": None, "startup_ms": None, "attempts": 0, "steps": {}}
+STARTUP_RETRY_MAX_SECONDS = int(os.getenv("STARTUP_RETRY_MAX_SECONDS", "30"))
+# The startup thread writes STARTUP_STATE while /health/ready serializes it
+STARTUP_LOCK = threading.Lock()
+
+def _set_startup_state(**fields):
+    with STARTUP_LOCK:
+        STARTUP_STATE.update(fields)
+
+def _startup_step(name, fn, required=True):
+    started = time.perf_counter()
+    step = {"required": required}
+    try:
+        step.update(ok=True, detail=fn())
+    except Exception as e:
+        step.update(ok=False, error=str(e))
+        print(f"Startup step '{name}' failed: {e}")
+    step["ms"] = int((time.perf_counter() - started) * 1000)
+    with STARTUP_LOCK:
+        STARTUP_STATE["steps"][name] = step
+    return step["ok"]
+
+def _load_schema():
+    if not load_schema():
+        raise Exception("schema.yaml is missing or empty")
+    return f"{len(get_allowlist()['tables'])} tables"
+
+def _load_mapping():
+    global _mapper
+    reports = get_mapper().config.get("reports", {})
+    if not reports:
+        _mapper = None  # reload mapping.json on the next attempt
+        raise Exception("mapping.json has no reports")
+    return f"{len(reports)} reports"
+
+def _load_catalog():
+    if not load_report_catalog():
+        raise Exception(f"Report catalog {CATALOG_PATH} is missing or empty")
+    return f"{len(load_report_catalog())} reports"
+
+def run_startup_phase():
+    """
+    Pays every warm-up cost once, right after boot, instead of on the first
+    requests: schema + validator allowlist, DHIS2 mapping, SQL templates,
+    report catalog, DB pool and (optionally) an LLM round trip. Failed
+    required steps are retried with backoff until they succeed, so a DB that
+    comes up after the container still ends in "ready".
+    """
+    started = time.perf_counter()
+    _set_startup_state(started_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    pending = {
+        "schema": _load_schema,
+        "mapping": _load_mapping,
+        "templates": lambda: f"{load_templates()} templates",
+        "catalog": _load_catalog,
+        "db_pool": lambda: f"{warm_pool()} connections",
+    }
+    delay, attempts = 1, 0
+    while True:
+        attempts += 1
+        _set_startup_state(attempts=attempts)
+        for name, fn in list(pending.items()):
+            if _startup_step(name, fn):
+                del pending[name]
+        if not pending:
+            break
+        _set_startup_state(status="not_ready")
+        print(f"Startup steps {list(pending)} failed; retrying in {delay}s")
+        time.sleep(delay)
+        delay = min(delay * 2, STARTUP_RETRY_MAX_SECONDS)
+
+    startup_ms = int((time.perf_counter() - started) * 1000)
+    _set_startup_state(startup_ms=startup_ms, status="ready")
+    print(f"Startup phase finished in {startup_ms} ms after {attempts} attempt(s)")
+
+    # The offline router answers without the LLM, so it does not gate readiness
+    if os.getenv("STARTUP_PING_LLM", "1") == "1":
+        _startup_step("llm", ping_llm, required=False)
+    # "auto" only catches up a store that already exists: building one from
+    # scratch is a full scan of OpenMRS, left to the first question that needs it
+    refresh_summaries = os.getenv("STARTUP_REFRESH_SUMMARIES", "auto")
+    if refresh_summaries == "1" or (refresh_summaries == "auto" and os.path.exists(AGG_DB_PATH)):
+        _startup_step("summaries", lambda: refresh_all_summaries() or f"{len(SUMMARIES)} summaries", required=False)
+
+@app.on_event("startup")
+def start_warmup():
+    # Runs in the background so the server accepts connections (and liveness probes) immediately
+    threading.Thread(target=run_startup_phase, name="startup-phase", daemon=True).start()
+
+@app.get("/health/ready")
+def health_ready():
+    with STARTUP_LOCK:
+        state = {**STARTUP_STATE, "steps": {name: dict(step) for name, step in STARTUP_STATE["steps"].items()}}
+    return JSONResponse(status_code=200 if state["status"] == "ready" else 503, content=state)
+
 # --- Moderation & Learning Routes ---
 
 @app.on_event("startup")
@@ -0,0 +1,133 @@
+# ---------------------------------------------------------
+# Bahmni AI + DHIS2 Sync Tool
+# Copyright (c) 2026 [Deepak Neupane]
+# Licensed under the MIT License (see LICENSE for details)
+# ---------------------------------------------------------
+# ================================
+# File: bench_startup.py
+# Purpose: Track cold-start cost (import time, readiness, first /ai/query)
+# ================================
+#
+# Usage (from the repo root, with the OpenMRS DB reachable):
+#   python bench_startup.py --runs 5 --question "103" --output bench_output.txt
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def measure_import(runs):
+    """Median seconds to `import app` in a fresh interpreter, plus the slowest modules."""
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=BASE_DIR, capture_output=True, text=True, check=True)
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    trace = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                           cwd=BASE_DIR, capture_output=True, text=True)
+    # Depth is "1 + 2 * level" spaces after the last "|", and children are
+    # printed before their parent, so app's direct imports are the depth-1
+    # lines collected just before the depth-0 "app" line.
+    modules, children = [], []
+    for line in trace.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth == 1:
+            children.append((int(parts[1]), name.strip()))
+        elif depth == 0:
+            if name.strip() == "app":
+                modules = children
+            children = []
+    modules.sort(reverse=True)
+
+    return {
+        "import_ms_median": round(statistics.median(samples) * 1000, 1),
+        "import_ms_samples": [round(s * 1000, 1) for s in samples],
+        "slowest_imports_ms": {name: round(us / 1000, 1) for us, name in modules[:8]},
+    }
+
+def _request(url, payload=None, timeout=60):
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as res:
+            return res.status, json.loads(res.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+def measure_first_query(port, question, start_date, end_date, timeout):
+    """Boots uvicorn and times: listening, /health/ready == 200, first error-free /ai/query."""
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    result = {"listening_ms": None, "ready_ms": None, "first_query_ms": None, "startup_state": None}
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                status, body = _request(f"{base}/health/ready", timeout=2)
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.05)
+                continue
+            now = int((time.perf_counter() - started) * 1000)
+            if result["listening_ms"] is None:
+                result["listening_ms"] = now
+            if status == 200:
+                result["ready_ms"] = now
+                result["startup_state"] = body
+                break
+            time.sleep(0.05)
+
+        payload = {"question": question, "start_date": start_date, "end_date": end_date}
+        while time.perf_counter() - started < timeout:
+            try:
+                status, body = _request(f"{base}/ai/query", payload)
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.1)
+                continue
+            data = (body or {}).get("data") or []
+            if status == 200 and not (data and "Error" in data[0]):
+                result["first_query_ms"] = int((time.perf_counter() - started) * 1000)
+                break
+            time.sleep(0.1)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for the AI/DHIS2 sync service")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=9123)
+    parser.add_argument("--question", default="103")
+    parser.add_argument("--start-date", default="2025-01-01")
+    parser.add_argument("--end-date", default="2025-12-31")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--skip-server", action="store_true", help="only measure import time")
+    parser.add_argument("--output", help="append the JSON result as one line to this file")
+    args = parser.parse_args()
+
+    report = {"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), **measure_import(args.runs)}
+    if not args.skip_server:
+        report.update(measure_first_query(args.port, args.question, args.start_date, args.end_date, args.timeout))
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(report) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -9,52 +9,89 @@
 # ================================
 
 import os
-import mysql.connector
+import threading
+
+# mysql.connector is imported on first use (or by warm_pool at startup) so
+# importing this module stays cheap.
+POOL_SIZE = min(int(os.getenv("OPENMRS_DB_POOL_SIZE", "8")), 32)  # mysql-connector caps pools at 32
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(POOL_SIZE)
+
+def _connector():
+    import mysql.connector
+    import mysql.connector.pooling
+    return mysql.connector
+
+def _db_config():
+    return {
+        "host": os.getenv("OPENMRS_DB_HOST", "openmrsdb"),
+        "user": os.getenv("OPENMRS_DB_USERNAME", "openmrs-user"),
+        "password": os.getenv("OPENMRS_DB_PASSWORD", "password"),
+        "database": os.getenv("OPENMRS_DB_NAME", "openmrs"),
+    }
 
 # --------------------------------
 # Database connection helper
 # --------------------------------
+def get_pool():
+    """Creates the shared connection pool on first use (opens POOL_SIZE connections)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _connector().pooling.MySQLConnectionPool(
+                    pool_name="openmrs", pool_size=POOL_SIZE, pool_reset_session=True, **_db_config()
+                )
+    return _pool
+
 def get_connection():
-    return mysql.connector.connect(
-        host=os.getenv("OPENMRS_DB_HOST", "openmrsdb"),
-        user=os.getenv("OPENMRS_DB_USERNAME", "openmrs-user"),
-        password=os.getenv("OPENMRS_DB_PASSWORD", "password"),
-        database=os.getenv("OPENMRS_DB_NAME", "openmrs"),
-    )
+    # close() on a pooled connection hands it back to the pool
+    return get_pool().get_connection()
+
+def warm_pool():
+    """Opens the pool and round-trips one query; used by the startup phase."""
+    execute_sql("SELECT 1 AS ok", quiet=True)
+    return POOL_SIZE
 
 # --------------------------------
 # Public API used by app.py
 # --------------------------------
-def execute_sql(sql: str):
+def execute_sql(sql: str, params=None, quiet=False):
     """
-    Executes SELECT SQL and returns rows as list of dicts
+    Executes SELECT SQL and returns rows as list of dicts.
+    Optional `params` are bound as %s placeholders.
     """
 
     if not sql or not sql.strip():
         raise Exception("Empty SQL received for execution")
 
+    mysql_connector = _connector()
     conn = None
     cursor = None
 
-    try:
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
+    # Wait for a free pooled connection instead of failing with "pool exhausted"
+    with _pool_slots:
+        try:
+            conn = get_connection()
+            cursor = conn.cursor(dictionary=True)
 
-        print("\n========== EXECUTING SQL ==========\n")
-        print(sql)
-        print("\n==================================\n")
+            if not quiet:
+                print("\n========== EXECUTING SQL ==========\n")
+                print(sql)
+                print("\n==================================\n")
 
-        cursor.execute(sql)
-        result = cursor.fetchall()
+            cursor.execute(sql, params)
+            result = cursor.fetchall()
 
-        return result
+            return result
 
-    except mysql.connector.Error as e:
-        # This will return the specific DB error to the FastAPI console
-        raise Exception(f"MySQL Error: {str(e)}")
+        except mysql_connector.Error as e:
+            # This will return the specific DB error to the FastAPI console
+            raise Exception(f"MySQL Error: {str(e)}")
 
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
\ No newline at end of file
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
\ No newline at end of file
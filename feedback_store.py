@@ -7,9 +7,11 @@ import sqlite3
 import os
 
 DB_PATH = "memory_store.db"
+_initialized = False
 
 def init_db():
-    """Creates the database and table if they don't exist."""
+    """Creates the database and table if they don't exist (on first write, not at import)."""
+    global _initialized
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     cursor.execute('''
@@ -24,9 +26,12 @@ def init_db():
     ''')
     conn.commit()
     conn.close()
+    _initialized = True
 
 def save_successful_query(question, sql, report_name):
     """Saves a verified SQL query to help the AI learn."""
+    if not _initialized:
+        init_db()
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     cursor.execute(
@@ -51,6 +56,3 @@ def get_learned_examples(limit=5):
     rows = cursor.fetchall()
     conn.close()
     return rows
-
-# Initialize the database immediately when this module is imported
-init_db()
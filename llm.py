@@ -5,11 +5,19 @@
 # ---------------------------------------------------------
 import os
 import re
+import threading
 
 #  CONFIGURATION 
 SQL_FOLDER = os.path.join(os.path.dirname(__file__), "queries")
-if not os.path.exists(SQL_FOLDER):
-    os.makedirs(SQL_FOLDER)
+_templates = {}
+
+# Upper bound on simultaneous LLM requests (report packs fan out to this)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+_llm_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_clients = {}
+
+# Commands that must never reach SQL generation
+BLOCKED_COMMANDS = ["drop ", "delete ", "truncate ", "update ", "alter "]
 
 # Pre-defined manual report list
 MANUAL_REPORTS = {
@@ -20,11 +28,56 @@ MANUAL_REPORTS = {
     "105": "Pharmacy Medication Orders"
 }
 
+def get_client(api_key, base_url):
+    """One shared client per endpoint so connections are reused across requests."""
+    key = (api_key, base_url)
+    if key not in _clients:
+        from openai import OpenAI
+        _clients[key] = OpenAI(api_key=api_key, base_url=base_url)
+    return _clients[key]
+
+def _llm_config():
+    return (
+        os.getenv("OPENAI_API_KEY", "ollama"),
+        os.getenv("OPENAI_BASE_URL", "http://localhost:11434/v1"),
+        os.getenv("LLM_MODEL", "qwen2.5-coder:7b"),
+    )
+
+def ping_llm(timeout=5):
+    """Imports the client, opens a connection and lists models; used by the startup phase."""
+    api_key, base_url, model_name = _llm_config()
+    client = get_client(api_key, base_url)
+    client.with_options(timeout=timeout).models.list()
+    return model_name
+
+def get_template(query_id):
+    """Returns a manual report's SQL with comments stripped, re-reading the file only when it changes."""
+    file_path = os.path.join(SQL_FOLDER, f"{query_id}.sql")
+    try:
+        mtime = os.path.getmtime(file_path)
+    except OSError:
+        return None
+    cached = _templates.get(query_id)
+    if not cached or cached[0] != mtime:
+        with open(file_path, 'r') as f:
+            raw_sql = f.read().strip()
+        clean_sql = re.sub(r'(--.*)|(/\*[\s\S]*?\*/)', '', raw_sql).strip()
+        if clean_sql.endswith(";"): clean_sql = clean_sql[:-1]
+        cached = _templates[query_id] = (mtime, clean_sql)
+    return cached[1]
+
+def load_templates():
+    """Preloads every queries/*.sql template; returns how many were loaded."""
+    if not os.path.isdir(SQL_FOLDER):
+        return 0
+    ids = [f[:-4] for f in os.listdir(SQL_FOLDER) if f.endswith(".sql")]
+    return sum(1 for query_id in ids if get_template(query_id) is not None)
+
 def ask_llm(prompt_text: str, question_text: str, start_date=None, end_date=None) -> str:
     clean_q = question_text.lower().strip()
 
     # --- 1. SECURITY CHECK ---
-    if any(cmd in clean_q for cmd in ["drop ", "delete ", "truncate ", "update ", "alter "]):
+    if any(cmd in clean_q for cmd in BLOCKED_COMMANDS):
         return "SELECT 'SECURITY WARNING: Action blocked' as message;"
 
     # --- 2. MENU MODE ---
@@ -36,32 +89,27 @@ def ask_llm(prompt_text: str, question_text: str, start_date=None, end_date=None
     match = re.match(r"^(?:sql\s+)?(\d+)$", clean_q)
     if match:
         query_id = match.group(1)
-        file_path = os.path.join(SQL_FOLDER, f"{query_id}.sql")
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                raw_sql = f.read().strip()
-                clean_sql = re.sub(r'(--.*)|(/\*[\s\S]*?\*/)', '', raw_sql).strip()
-                if clean_sql.endswith(";"): clean_sql = clean_sql[:-1]
-                return clean_sql.replace("{start_date}", str(start_date)).replace("{end_date}", str(end_date))
+        clean_sql = get_template(query_id)
+        if clean_sql is not None:
+            return clean_sql.replace("{start_date}", str(start_date)).replace("{end_date}", str(end_date))
         return f"SELECT 'Error: File {query_id}.sql not found' as message;"
 
     # --- 4. AI PATH (LOCAL OLLAMA PRODUCTION) ---
-    api_key = os.getenv("OPENAI_API_KEY", "ollama") 
-    base_url = os.getenv("OPENAI_BASE_URL", "http://localhost:11434/v1") 
-    model_name = os.getenv("LLM_MODEL", "qwen2.5-coder:7b") 
+    api_key, base_url, model_name = _llm_config()
 
     if api_key:
         try:
-            from openai import OpenAI
-            client = OpenAI(api_key=api_key, base_url=base_url)
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": prompt_text},
-                    {"role": "user", "content": f"Dates: {start_date} to {end_date}. Query: {question_text}"}
-                ],
-                temperature=0
-            )
+            client = get_client(api_key, base_url)
+            # The system prompt comes first and unchanged so the server can reuse its prompt cache
+            with _llm_slots:
+                response = client.chat.completions.create(
+                    model=model_name,
+                    messages=[
+                        {"role": "system", "content": prompt_text},
+                        {"role": "user", "content": f"Dates: {start_date} to {end_date}. Query: {question_text}"}
+                    ],
+                    temperature=0
+                )
             sql = response.choices[0].message.content.strip()
             return re.sub(r'```sql|```', '', sql).strip().split(';')[0]
         except Exception as e:
@@ -41,10 +41,26 @@ def get_approved_memory():
         print(f"Memory Fetch Error: {e}")
         return ""
 
-def build_prompt(schema: str, question: str, start_date: str = None, end_date: str = None) -> str:
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.yaml")
+_schema_cache = {"mtime": None, "text": ""}
+
+def load_schema() -> str:
+    """Returns schema.yaml, re-reading it only when the file changes."""
+    try:
+        mtime = os.path.getmtime(SCHEMA_PATH)
+        if mtime != _schema_cache["mtime"]:
+            with open(SCHEMA_PATH) as f:
+                _schema_cache["text"] = f.read()
+            _schema_cache["mtime"] = mtime
+    except OSError:
+        return ""
+    return _schema_cache["text"]
+
+def build_system_prompt(schema: str, start_date: str = None, end_date: str = None) -> str:
     """
-    Constructs a high-precision system prompt for Bahmni/OpenMRS SQL generation.
-    Now includes a 'Memory' section that pulls from the approved database.
+    Constructs the question-independent part of the prompt (schema, rules,
+    memory, examples). It is identical for every question in the same date
+    range, so it forms a stable prefix the LLM server can cache.
     """
     
     # Fallback dynamic dates
@@ -81,11 +97,18 @@ Your goal is to generate clean, executable MySQL queries.
 ## BASELINE EXAMPLES:
 User: "How many patients registered?"
 SQL: SELECT COUNT(*) FROM person pe WHERE pe.voided = 0 AND DATE(pe.date_created) BETWEEN '{start_date}' AND '{end_date}';
+"""
 
+    return system_instruction
+
+def build_prompt(schema: str, question: str, start_date: str = None, end_date: str = None) -> str:
+    """
+    Constructs a high-precision system prompt for Bahmni/OpenMRS SQL generation.
+    Now includes a 'Memory' section that pulls from the approved database.
+    """
+    return build_system_prompt(schema, start_date, end_date) + f"""
 ## ACTUAL USER QUESTION:
 "{question}"
 
 ## SQL:
 """
-
-    return system_instruction
@@ -0,0 +1,134 @@
+# ---------------------------------------------------------
+# Bahmni AI + DHIS2 Sync Tool
+# Copyright (c) 2026 [Deepak Neupane]
+# Licensed under the MIT License (see LICENSE for details)
+# ---------------------------------------------------------
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import aggregates
+
+class FakeSource:
+    """Stands in for execute_sql: keeps OpenMRS-like rows and records every query."""
+
+    def __init__(self):
+        self.rows = {}
+        self.calls = []
+
+    def put(self, row_id, day, changed_at, dim="General", voided=0, midnight=0):
+        self.rows[row_id] = {"row_id": row_id, "day": day, "dim": dim, "midnight": midnight,
+                             "voided": voided, "changed_at": datetime.strptime(changed_at, "%Y-%m-%d %H:%M:%S")}
+
+    def __call__(self, sql, params=None, quiet=False):
+        self.calls.append((sql, params))
+        since = params[0] if params else None
+        return [dict(r) for r in self.rows.values()
+                if since is None or r["changed_at"].strftime("%Y-%m-%d %H:%M:%S") >= since]
+
+@pytest.fixture
+def source(monkeypatch, tmp_path):
+    fake = FakeSource()
+    monkeypatch.setattr(aggregates, "execute_sql", fake)
+    monkeypatch.setattr(aggregates, "AGG_DB_PATH", str(tmp_path / "aggregate_store.db"))
+    monkeypatch.setattr(aggregates, "_refresh_in_background", lambda name: None)
+    return fake
+
+def daily(name):
+    conn = sqlite3.connect(aggregates.AGG_DB_PATH)
+    try:
+        return dict(conn.execute("SELECT day, SUM(total) FROM aggregate_daily WHERE summary = ? GROUP BY day",
+                                 (name,)).fetchall())
+    finally:
+        conn.close()
+
+def test_incremental_fetch_rereads_lookback_window(source):
+    source.put(1, "2025-03-01", "2025-03-01 10:00:00")
+    aggregates.refresh("person_registrations")
+    assert source.calls[0][1] is None  # first build is a full scan
+
+    aggregates.refresh("person_registrations")
+    sql, params = source.calls[-1]
+    assert params == ("2025-03-01 09:59:00",) * 3
+
+def test_fetch_is_one_union_branch_per_change_column(source):
+    source.put(1, "2025-03-01", "2025-03-01 10:00:00")
+    aggregates.refresh("program_enrollment")
+    aggregates.refresh("program_enrollment")
+    sql, params = source.calls[-1]
+    columns = aggregates.SUMMARIES["program_enrollment"]["change_columns"]
+    assert sql.count("UNION") == len(columns) - 1
+    for column in columns:
+        assert f"AND {column} >= %s" in sql
+    assert " OR " not in sql
+
+def test_voided_rows_leave_the_daily_counts(source):
+    source.put(1, "2025-03-01", "2025-03-01 10:00:00")
+    source.put(2, "2025-03-01", "2025-03-01 11:00:00")
+    aggregates.refresh("person_registrations")
+    assert daily("person_registrations") == {"2025-03-01": 2}
+
+    source.put(2, "2025-03-01", "2025-03-02 08:00:00", voided=1)
+    aggregates.refresh("person_registrations")
+    assert daily("person_registrations") == {"2025-03-01": 1}
+
+def test_row_moved_to_another_day_recounts_both_days(source):
+    source.put(1, "2025-03-01", "2025-03-01 10:00:00")
+    source.put(2, "2025-03-01", "2025-03-01 11:00:00")
+    aggregates.refresh("person_registrations")
+
+    source.put(2, "2025-03-05", "2025-03-02 08:00:00")
+    aggregates.refresh("person_registrations")
+    assert daily("person_registrations") == {"2025-03-01": 1, "2025-03-05": 1}
+
+def test_empty_source_records_sentinel_and_stays_incremental(source):
+    info = aggregates.refresh("anc_obs")
+    assert info["high_water"] == aggregates.EMPTY_HIGH_WATER
+    assert info["status"] == "ready"
+
+    aggregates.refresh("anc_obs")
+    assert source.calls[-1][1] is not None  # not another full scan
+
+def test_report_103_counts_only_midnight_rows_on_end_day(source):
+    source.put(1, "2025-01-01", "2025-01-01 09:00:00", dim="HIV")
+    source.put(2, "2025-01-31", "2025-01-31 00:00:00", dim="HIV", midnight=1)
+    source.put(3, "2025-01-31", "2025-01-31 14:00:00", dim="HIV")
+    aggregates.refresh("program_enrollment")
+
+    result = aggregates.answer("103", "2025-01-01", "2025-01-31")
+    assert result["data"] == [{"Program Name": "HIV", "Enrollment Count": 2, "Month": "2025-01"}]
+    assert "pp.date_enrolled BETWEEN '2025-01-01' AND '2025-01-31'" in result["sql"]
+    assert "DATE(pp.date_enrolled)" not in result["sql"]
+
+def test_answer_reports_freshness(source):
+    source.put(1, "2025-03-01", "2025-03-01 10:00:00")
+    aggregates.refresh("person_registrations")
+
+    result = aggregates.answer("registered patients", "2025-03-01", "2025-03-31")
+    assert result["data"] == [{"Registrations": 1}]
+    assert result["high_water"] == "2025-03-01 10:00:00"
+    assert result["age_seconds"] is not None
+
+def test_too_old_summary_falls_back_to_live(source):
+    source.put(1, "2025-03-01", "2025-03-01 10:00:00")
+    aggregates.refresh("person_registrations")
+
+    conn = sqlite3.connect(aggregates.AGG_DB_PATH)
+    conn.execute("UPDATE aggregate_state SET last_refresh = '2000-01-01 00:00:00'")
+    conn.commit()
+    conn.close()
+    assert aggregates.answer("registered patients", "2025-03-01", "2025-03-31") is None
+
+def test_failed_refresh_falls_back_to_live(source, monkeypatch):
+    source.put(1, "2025-03-01", "2025-03-01 10:00:00")
+    aggregates.refresh("person_registrations")
+
+    def broken(sql, params=None, quiet=False):
+        raise Exception("db down")
+    monkeypatch.setattr(aggregates, "execute_sql", broken)
+    with pytest.raises(Exception):
+        aggregates.refresh("person_registrations")
+    info = aggregates.summary_info("person_registrations")
+    assert info["status"] == "error" and not info["stale"]
+    assert aggregates.answer("registered patients", "2025-03-01", "2025-03-31") is None
@@ -0,0 +1,67 @@
+# ---------------------------------------------------------
+# Bahmni AI + DHIS2 Sync Tool
+# Copyright (c) 2026 [Deepak Neupane]
+# Licensed under the MIT License (see LICENSE for details)
+# ---------------------------------------------------------
+import pytest
+
+import validator
+from validator import SQLValidationError, check_sql, validate_sql
+
+def codes(sql):
+    return [r["code"] for r in check_sql(sql)]
+
+@pytest.mark.parametrize("sql", [
+    "SELECT p.date_changed, p.updated_by FROM person p WHERE p.voided = 0",
+    "SELECT EXTRACT(YEAR FROM pe.date_created) AS yr, TRIM(LEADING '0' FROM pi.identifier) "
+    "FROM person pe JOIN patient_identifier pi ON pi.patient_id = pe.person_id",
+    "SELECT * FROM person pe JOIN patient pa ON pa.patient_id = pe.person_id, obs o",
+    "SELECT t.n FROM (SELECT COUNT(*) AS n FROM person WHERE voided = 0) t",
+    "WITH enrolled AS (SELECT patient_id FROM patient_program WHERE voided = 0), "
+    "recent AS (SELECT * FROM enrolled) SELECT COUNT(*) FROM recent r "
+    "WHERE r.patient_id IN (SELECT patient_id FROM enrolled)",
+    "SELECT COUNT(*) FROM obs o WHERE o.concept_id IN (SELECT concept_id FROM concept_name WHERE name LIKE '%drop table%');",
+])
+def test_accepts_valid_reports(sql):
+    assert check_sql(sql) == []
+    assert validate_sql(sql) is True
+
+@pytest.mark.parametrize("sql, code", [
+    ("SELECT * FROM person INTO OUTFILE '/tmp/person.csv'", "forbidden_keyword"),
+    ("SELECT SLEEP(10)", "dangerous_function"),
+    ("SELECT BENCHMARK(100000000, 1) FROM person", "dangerous_function"),
+    ("SELECT 1 FROM person; DROP TABLE person", "multiple_statements"),
+    ("SELECT @x := 1 FROM person", "variables_not_allowed"),
+    ("SELECT @@version", "variables_not_allowed"),
+    ("SELECT 1 /*M! , SLEEP(5) */ FROM person", "executable_comment"),
+    ("SELECT 1 /*!50000 , SLEEP(5) */ FROM person", "executable_comment"),
+    ("SELECT * FROM person p JOIN (users u) ON 1=1", "table_not_allowed"),
+    ("SELECT * FROM person JOIN patient USING (person_id), users", "table_not_allowed"),
+    ("SELECT * FROM person p JOIN ((patient pa, users u)) ON 1=1", "table_not_allowed"),
+    ("SELECT * FROM mysql.user", "table_not_allowed"),
+    ("WITH users AS (SELECT 1) SELECT * FROM person WHERE person_id IN (SELECT user_id FROM openmrs.users)",
+     "table_not_allowed"),
+    ("SELECT * FROM (WITH users AS (SELECT 1 AS x) SELECT * FROM users) t, users", "table_not_allowed"),
+])
+def test_rejects_unsafe_sql(sql, code):
+    assert code in codes(sql)
+    with pytest.raises(SQLValidationError) as err:
+        validate_sql(sql)
+    assert err.value.reasons
+
+def test_cache_hit_returns_same_verdict():
+    sql = "SELECT * FROM person p JOIN (users u) ON 1=1"
+    first = check_sql(sql)
+    assert first
+    # Same SQL after normalization (case and spacing) is served from the cache
+    assert check_sql("select *   from PERSON p join (users u) on 1=1") is first
+
+def test_executable_comment_case_cannot_poison_cache():
+    validator._cache.clear()
+    assert "executable_comment" in codes("SELECT 1 /*m! , SLEEP(5) */ FROM person")
+    assert "executable_comment" in codes("SELECT 1 /*M! , SLEEP(5) */ FROM person")
+
+@pytest.mark.parametrize("schema_text", ["", "tables: [", "just a string"])
+def test_missing_or_invalid_schema_fails_closed(monkeypatch, schema_text):
+    monkeypatch.setattr(validator, "load_schema", lambda: schema_text)
+    assert codes("SELECT * FROM person") == ["schema_unavailable"]
@@ -4,20 +4,257 @@
 # Developed by: Deepak Neupane
 # Copyright:    (c) 2025 Deepak Neupane
 # License:      MIT
-# Function:     Validates LLM-generated SQL against a strict whitelist 
+# Function:     Validates LLM-generated SQL against a strict whitelist
 #               to prevent SQL Injection and unauthorized data access.
 # =====================================================================
+#
+# The SQL is tokenized once (strings, comments and quoted identifiers are
+# real tokens, so a column called `date_updated` is not a forbidden word).
+# A single walk over the tokens then checks: one SELECT/WITH statement,
+# no write/lock/file keywords, no user variables or executable comments,
+# every table in FROM/JOIN and every function call on the allowlist built
+# from schema.yaml. Verdicts are cached per normalized SQL hash.
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
 
-FORBIDDEN = ["insert", "update", "delete", "drop", "alter"]
+import yaml
 
-def validate_sql(sql):
-    sql_lower = sql.lower()
-    
-    for word in FORBIDDEN:
-        if word in sql_lower:
-            raise Exception("Unsafe SQL detected")
+from prompt import load_schema
+
+# Statement keywords that may never appear outside a function call
+FORBIDDEN = {
+    "insert", "update", "delete", "drop", "alter", "create", "truncate", "replace",
+    "rename", "grant", "revoke", "call", "handler", "load", "lock", "unlock",
+    "into", "outfile", "dumpfile", "prepare", "execute", "deallocate",
+    "shutdown", "kill", "flush",
+}
+
+# Functions that stall or escape the DB; always rejected with their own code
+DANGEROUS_FUNCTIONS = {
+    "sleep", "benchmark", "load_file", "get_lock", "release_lock", "release_all_locks",
+    "is_free_lock", "is_used_lock", "master_pos_wait", "source_pos_wait", "sys_exec", "sys_eval",
+}
+
+# Keywords that can be followed by "(" without being a function call
+NON_FUNCTION_KEYWORDS = {
+    "select", "from", "join", "where", "on", "using", "in", "exists", "as", "and", "or",
+    "not", "over", "values", "union", "all", "any", "some", "distinct", "when", "then",
+    "else", "by", "is", "like", "between", "with", "lateral", "partition", "having",
+}
+
+# Keywords that end a FROM list. ON/USING do not: a "," after a join
+# condition still introduces another table.
+CLAUSE_KEYWORDS = {"where", "group", "order", "having", "limit", "union", "window"}
+JOIN_KEYWORDS = {"join", "straight_join"}
+
+CACHE_SIZE = int(os.getenv("SQL_VALIDATION_CACHE_SIZE", "512"))
+
+TOKEN_RE = re.compile(
+    r"(?P<ws>\s+)"
+    r"|(?P<exec_comment>/\*M?!.*?(?:\*/|\Z))"
+    r"|(?P<comment>/\*.*?\*/|(?:--(?=\s|$)|#)[^\n]*)"
+    r"|(?P<string>'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\")"
+    r"|(?P<quoted>`(?:[^`]|``)*`)"
+    r"|(?P<number>0x[0-9a-fA-F]+|\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)"
+    r"|(?P<ident>[A-Za-z_$][\w$]*)"
+    r"|(?P<var>@@?[\w$.]*)"
+    r"|(?P<op><=>|<=|>=|<>|!=|:=|\|\||&&|<<|>>|[-+*/%=<>!~^&|(),.;?:])"
+    r"|(?P<bad>.)",
+    # Case-insensitive like the cache key (_normalize lowercases), so /*m! and
+    # /*M! can never share a cached verdict while tokenizing differently
+    re.S | re.I,
+)
+
+class SQLValidationError(Exception):
+    """Raised with structured `reasons` ({code, message, token, position}) for LLM retries."""
+
+    def __init__(self, reasons):
+        self.reasons = reasons
+        super().__init__("; ".join(r["message"] for r in reasons))
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_allowlist = {"source": None, "tables": set(), "functions": set()}
+
+# --------------------------------
+# Allowlist from schema.yaml
+# --------------------------------
+def get_allowlist():
+    """Tables and functions from schema.yaml; rebuilt (and the cache cleared) when it changes."""
+    schema_text = load_schema()
+    if schema_text is not _allowlist["source"]:
+        try:
+            schema = yaml.safe_load(schema_text) or {}
+        except yaml.YAMLError as e:
+            print(f"Validator: could not parse schema.yaml: {e}")
+            schema = {}
+        if not isinstance(schema, dict):
+            schema = {}
+        tables = {str(t["name"]).lower() for t in schema.get("tables") or [] if isinstance(t, dict) and t.get("name")}
+        functions = {str(f).lower() for f in schema.get("allowed_functions") or []}
+        with _cache_lock:
+            _allowlist.update(source=schema_text, tables=tables, functions=functions)
+            _cache.clear()
+    return _allowlist
+
+# --------------------------------
+# Tokenizer
+# --------------------------------
+def tokenize(sql):
+    """Returns significant tokens as (kind, value, position); whitespace and comments dropped."""
+    tokens = []
+    for m in TOKEN_RE.finditer(sql):
+        kind = m.lastgroup
+        if kind in ("ws", "comment"):
+            continue
+        tokens.append((kind, m.group(), m.start()))
+    return tokens
+
+def _normalize(sql):
+    # Verdicts never depend on letter case or on how whitespace is laid out,
+    # but a newline ends a "--" comment, so it is kept distinct from spaces.
+    text = re.sub(r"[ \t]*(?:\r?\n)\s*", "\n", sql.strip().lower())
+    return re.sub(r"[ \t]+", " ", text)
+
+# --------------------------------
+# Single-pass checker
+# --------------------------------
+def check_sql(sql):
+    """Returns a list of rejection reasons; an empty list means the SQL is allowed."""
+    if not sql or not sql.strip():
+        return [{"code": "empty", "message": "Empty SQL", "token": "", "position": 0}]
 
-    if not sql_lower.strip().startswith("select"):
-        raise Exception("Only SELECT queries allowed")
+    allow = get_allowlist()
+    if not allow["tables"] or not allow["functions"]:
+        # Never validate without an allowlist; not cached so recovery is immediate
+        return [{"code": "schema_unavailable",
+                 "message": "schema.yaml is missing, empty or invalid; table/function allowlist unavailable",
+                 "token": "", "position": 0}]
 
+    key = hashlib.sha256(_normalize(sql).encode("utf-8")).hexdigest()
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    reasons = _walk(tokenize(sql), allow)
+
+    with _cache_lock:
+        _cache[key] = reasons
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return reasons
+
+def _walk(tokens, allow):
+    reasons = []
+    db_name = os.getenv("OPENMRS_DB_NAME", "openmrs").lower()
+
+    def reject(code, message, tok):
+        reasons.append({"code": code, "message": message, "token": tok[1], "position": tok[2]})
+
+    first = next((t for t in tokens if t[1] != "("), None)
+    if not first or first[1].lower() not in ("select", "with"):
+        reasons.append({"code": "not_select", "message": "Only SELECT queries allowed",
+                        "token": first[1] if first else "", "position": first[2] if first else 0})
+
+    # Each frame is one parenthesis level; "ctes" holds the CTE names declared
+    # by a WITH at that level, visible to it and to the frames nested inside.
+    frames = [{"clause": None, "expect_table": False, "call": False, "ctes": set()}]
+    expect_cte = False
+    pending_call = False
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        kind, value = tok[0], tok[1]
+        frame = frames[-1]
+        nxt = tokens[i + 1][1] if i + 1 < len(tokens) else None
+
+        if kind in ("ident", "quoted"):
+            name = value.strip("`").replace("``", "`").lower() if kind == "quoted" else value.lower()
+            if frame["expect_table"] and kind == "ident" and name in ("select", "with"):
+                frame["expect_table"] = False  # derived table: FROM (SELECT ...)
+
+            if expect_cte:
+                if name != "recursive":
+                    frame["ctes"].add(name)
+                    expect_cte = False
+            elif frame["expect_table"]:
+                frame["expect_table"] = False
+                schema_name = None
+                if nxt == "." and i + 2 < len(tokens) and tokens[i + 2][0] in ("ident", "quoted"):
+                    schema_name, name = name, tokens[i + 2][1].strip("`").lower()
+                    i += 2
+                if schema_name and schema_name != db_name:
+                    reject("table_not_allowed", f"Schema '{schema_name}' is not accessible", tok)
+                elif schema_name is None and any(name in f["ctes"] for f in frames):
+                    pass  # unqualified reference to a CTE in scope
+                elif name != "dual" and name not in allow["tables"]:
+                    reject("table_not_allowed", f"Table '{name}' is not in schema.yaml", tok)
+            elif nxt == "(" and (kind == "quoted" or name not in NON_FUNCTION_KEYWORDS):
+                pending_call = True
+                if name in DANGEROUS_FUNCTIONS:
+                    reject("dangerous_function", f"Function {name.upper()}() is not allowed", tok)
+                elif name not in allow["functions"]:
+                    reject("function_not_allowed", f"Function {name.upper()}() is not in the allowed function list", tok)
+            elif kind == "ident":
+                if name in FORBIDDEN:
+                    reject("forbidden_keyword", f"Keyword {name.upper()} is not allowed", tok)
+                elif name == "select":
+                    frame["clause"] = "select"
+                elif (name == "from" or name in JOIN_KEYWORDS) and not frame["call"]:
+                    # FROM inside EXTRACT()/TRIM()/SUBSTRING() is not a table list
+                    frame["clause"] = "from"
+                    frame["expect_table"] = True
+                elif name in CLAUSE_KEYWORDS:
+                    frame["clause"] = name
+                elif name == "with":
+                    frame["clause"] = "with"
+                    expect_cte = True
+
+        elif value == "(":
+            if frame["expect_table"]:
+                # "(" right after FROM/JOIN/",": a table group such as JOIN (a x, b y)
+                # or a derived table; either way its first item is still a table
+                frame["expect_table"] = False
+                frames.append({"clause": "from", "expect_table": True, "call": False, "ctes": set()})
+            else:
+                frames.append({"clause": None, "expect_table": False, "call": pending_call, "ctes": set()})
+            pending_call = False
+        elif value == ")":
+            if len(frames) == 1:
+                reject("syntax", "Unbalanced parentheses", tok)
+            else:
+                frames.pop()
+        elif value == ",":
+            if frame["clause"] == "from":
+                frame["expect_table"] = True
+            elif frame["clause"] == "with":
+                expect_cte = True
+        elif value == ";":
+            if i + 1 < len(tokens):
+                reject("multiple_statements", "Only one SQL statement allowed", tok)
+                break
+        elif kind == "var" or value == ":=":
+            reject("variables_not_allowed", "User/system variables are not allowed", tok)
+        elif kind == "exec_comment":
+            reject("executable_comment", "Executable comments (/*! ... */, /*M! ... */) are not allowed", tok)
+        elif kind == "bad":
+            reject("syntax", f"Unexpected character {value!r} (unterminated string or identifier?)", tok)
+        i += 1
+
+    if len(frames) > 1:
+        reasons.append({"code": "syntax", "message": "Unbalanced parentheses", "token": "", "position": len(tokens)})
+    return reasons
+
+def validate_sql(sql):
+    reasons = check_sql(sql)
+    if reasons:
+        raise SQLValidationError(reasons)
     return True
+
+def format_reasons(reasons):
+    """Renders rejection reasons as a prompt section for the LLM retry."""
+    return "\n".join(f"- [{r['code']}] {r['message']}" for r in reasons)